@@ -1,15 +1,21 @@
 import streamlit as st
 import os
+import subprocess
+import sys
 import json
 import time
 import pandas as pd
+import openpyxl
+import portalocker
 import yaml
 import base64
 import time
+import tempfile
+import threading
 
 # Import modules from src
 from src.utils import load_config
-from src.data_ingestor import load_and_process_camos_docs, create_and_save_vector_store, load_vector_store
+from src.data_ingestor import INGEST_OK, INGEST_NO_DOCUMENTS
 from src.rag_pipeline import CamosRAGPipeline
 
 # --- Streamlit UI Configuration ---
@@ -38,28 +44,165 @@ os.makedirs(os.path.dirname(EXCEL_FAQ_FILE), exist_ok=True)
 os.makedirs(os.path.dirname(PENDING_QUESTIONS_FILE), exist_ok=True)
 
 # --- Excel Data Management Functions ---
+# Each Excel path is backed by an append-only JSONL log next to it (e.g. data/faqs.jsonl), which is the
+# canonical store. A later line with the same id replaces a record and {"id": ..., "deleted": true}
+# removes it. The .xlsx files are only exports.
+LOG_COMPACTION_THRESHOLD_BYTES = 64 * 1024
+
+def _log_path(filepath):
+    return os.path.splitext(filepath)[0] + '.jsonl'
+
+@st.cache_resource
+def _get_lock(name):
+    """Process-wide lock shared by all sessions."""
+    return threading.Lock()
+
+def _log_file_lock(log_path):
+    """Exclusive lock on a log's .lock file, serializing appends and rewrites across threads and processes."""
+    return portalocker.Lock(log_path + '.lock', timeout=10)
+
+def _add_derived_columns(df):
+    """Adds the underscore-prefixed helper columns used by the UI. They are never persisted."""
+    if 'question' in df.columns:
+        searchable = df['question'].fillna('').astype(str)
+        if 'answer' in df.columns:
+            searchable = searchable + '\x1f' + df['answer'].fillna('').astype(str)
+        df['_search'] = searchable.str.lower()
+    if 'timestamp' in df.columns:
+        df['_ts_str'] = pd.to_datetime(df['timestamp'], format='ISO8601').dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    return df
+
+def _to_json_records(df):
+    """Converts a DataFrame to JSON-ready dicts, dropping derived columns."""
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith('_')])
+    if 'id' in df.columns:
+        df = df.astype({'id': str})  # Ids read back from Excel may be ints
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+def _write_log(log_path, records):
+    """Atomically replaces a log with the given records (temp file + rename)."""
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(log_path) or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, log_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _read_live_records(log_path):
+    """Replays a log and returns its live records, oldest first."""
+    records = {}
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break # Last line is still being written by a concurrent append
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.pop(record['id'], None)
+            if not record.get('deleted'):
+                records[record['id']] = record
+    return list(records.values())
+
+def _records_to_df(records, columns=None):
+    """Builds the newest-first DataFrame shown in the UI from oldest-first records."""
+    df = pd.DataFrame(list(reversed(records)), columns=columns)
+    if 'timestamp' in df.columns:
+        # Seeded rows carry millisecond ISO strings, appended rows Timestamp.isoformat(); parse both
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    return df
+
+@st.cache_data(show_spinner=False)
+def _read_log_cached(log_path, mtime, columns):
+    """Reads a log into a DataFrame. `mtime` is only part of the cache key, so any write invalidates it."""
+    return _add_derived_columns(_records_to_df(_read_live_records(log_path), list(columns)))
+
+def _ensure_log(filepath):
+    """Seeds the JSONL log for an Excel path from the Excel file on first use."""
+    log_path = _log_path(filepath)
+    if not os.path.exists(log_path) and os.path.exists(filepath):
+        with _log_file_lock(log_path):
+            if not os.path.exists(log_path):
+                # Excel rows are newest first; the log is oldest first
+                _write_log(log_path, list(reversed(_to_json_records(pd.read_excel(filepath, engine='openpyxl')))))
+    return log_path
+
 def load_data_from_excel(filepath, columns):
-    """Loads data from an Excel file, creating a new one if it doesn't exist."""
-    if os.path.exists(filepath):
-        try:
-            df = pd.read_excel(filepath, engine='openpyxl')
-            if 'timestamp' in df.columns:
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-            return df
-        except Exception as e:
-            st.warning(f"Error loading {filepath}: {e}. Creating a new empty DataFrame.")
-            return pd.DataFrame(columns=columns)
-    return pd.DataFrame(columns=columns)
-
-def save_data_to_excel(df, filepath):
-    """Saves a Pandas DataFrame to an Excel file."""
+    """
+    Loads the live records stored for an Excel path from its JSONL log, seeding the log
+    from the Excel file on first use. Returns an empty DataFrame if neither exists.
+    """
+    log_path = _log_path(filepath)
     try:
-        df.to_excel(filepath, index=False, engine='openpyxl')
+        _ensure_log(filepath)
+        if os.path.exists(log_path):
+            return _read_log_cached(log_path, os.stat(log_path).st_mtime_ns, tuple(columns))
+    except Exception as e:
+        st.warning(f"Error loading {log_path}: {e}. Creating a new empty DataFrame.")
+    return _add_derived_columns(pd.DataFrame(columns=columns))
+
+def save_data_to_excel_fast(df, filepath):
+    """Writes a DataFrame to an Excel file with a write-only openpyxl workbook, streaming rows instead of building a cell grid."""
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith('_')])
+    if 'timestamp' in df.columns and pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        # Convert the column once so openpyxl isn't handed a pandas Timestamp (or NaT) per cell
+        timestamps = pd.Series(df['timestamp'].dt.to_pydatetime(), index=df.index, dtype=object)
+        df = df.assign(timestamp=timestamps.where(df['timestamp'].notna(), None))
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(tuple(df.columns))
+    rows = df.itertuples(index=False, name=None)
+    for row in rows:
+        ws.append(row)
+    wb.save(filepath)
+
+def _compact_log(filepath, compaction_lock):
+    """
+    Drops replaced and deleted lines from a log and refreshes its Excel export.
+    Runs in a background thread, so the lock is resolved by the caller.
+    """
+    log_path = _log_path(filepath)
+    if not compaction_lock.acquire(blocking=False):
+        return # Another compaction of this log is already running
+    try:
+        with _log_file_lock(log_path):
+            records = _read_live_records(log_path)
+            _write_log(log_path, records)
+        save_data_to_excel_fast(_records_to_df(records), filepath)
+    except Exception as e:
+        print(f"Error compacting {log_path}: {e}")
+    finally:
+        compaction_lock.release()
+
+def append_row(filepath, row):
+    """Adds or replaces one record by appending a line to the log for an Excel path, without reading the existing data."""
+    log_path = _log_path(filepath)
+    try:
+        _ensure_log(filepath)
+        with _log_file_lock(log_path):
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(row, default=str) + '\n')
         return True
     except Exception as e:
-        st.error(f"Error saving to {filepath}: {e}")
+        st.error(f"Error saving to {log_path}: {e}")
         return False
 
+def delete_record(filepath, record_id):
+    """Removes a record by appending a tombstone to its log, compacting in the background once the log grows large."""
+    if not append_row(filepath, {'id': str(record_id), 'deleted': True}):
+        return False
+    log_path = _log_path(filepath)
+    if os.path.getsize(log_path) > LOG_COMPACTION_THRESHOLD_BYTES:
+        threading.Thread(
+            target=_compact_log,
+            args=(filepath, _get_lock(log_path + ':compaction')),
+            daemon=True
+        ).start()
+    return True
+
 # --- Initialize RAG Pipeline (once) ---
 @st.cache_resource
 def initialize_rag_pipeline_cached(config_data_for_cache):
@@ -79,28 +222,16 @@ def ingest_camos_data_to_faiss():
         return
 
     st.info("Starting Camos data ingestion into FAISS...")
-    os.makedirs(config_data.get('vector_store_path', "data/faiss_index"), exist_ok=True)
-    all_documents = load_and_process_camos_docs(
-        config_data.get('pdf_data_dir', "data/raw_pdfs"),
-        config_data.get('chunk_size', 500),
-        config_data.get('chunk_overlap', 50)
-    )
-
-    if not all_documents:
-        st.warning("No documents were loaded or processed for ingestion.")
-        return
+    # Run in a separate process: its spawned PDF workers would otherwise re-run this script
+    with st.spinner("Ingesting documents (see the console for progress)..."):
+        result = subprocess.run([sys.executable, "-m", "src.data_ingestor", CONFIG_FILE])
 
-    vectorstore = create_and_save_vector_store(
-        all_documents,
-        config_data.get('embedding_model_name', "sentence-transformers/all-MiniLM-L6-v2"),
-        config_data.get('embedding_model_kwargs', {'device': 'cpu'}),
-        config_data.get('vector_store_path', "data/faiss_index")
-    )
-
-    if vectorstore:
+    if result.returncode == INGEST_OK:
         st.success("Camos documentation successfully ingested into the FAISS knowledge base!")
         st.cache_resource.clear()
         st.rerun()
+    elif result.returncode == INGEST_NO_DOCUMENTS:
+        st.warning("No documents were loaded or processed for ingestion.")
     else:
         st.error("Failed to create/save vector store.")
 
@@ -181,30 +312,35 @@ def show_main_app():
             with st.chat_message("user"):
                 st.markdown(prompt)
 
-            with st.spinner("AI is thinking..."):
-                if rag_pipeline:
-                    try:
+            if rag_pipeline:
+                try:
+                    with st.chat_message("assistant"):
                         if "error" in prompt.lower() and "code" in prompt.lower():
-                            response = rag_pipeline.debug_code(
-                                code_snippet="Please provide the code snippet you're working with.",
-                                error_message="Please provide the exact error message."
-                            )
+                            with st.spinner("AI is thinking..."):
+                                response = rag_pipeline.debug_code(
+                                    code_snippet="Please provide the code snippet you're working with.",
+                                    error_message="Please provide the exact error message."
+                                )
+                            st.markdown(response)
                         else:
-                            response = rag_pipeline.query_rag(prompt)
+                            # Render tokens as Ollama generates them instead of waiting for the full answer
+                            if "chat_memory" not in st.session_state:
+                                st.session_state.chat_memory = rag_pipeline.create_memory()
+                            with st.spinner("AI is thinking..."):
+                                answer_stream = rag_pipeline.prepare_rag(prompt, st.session_state.chat_memory)
+                            response = st.write_stream(answer_stream)
 
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                        with st.chat_message("assistant"):
-                            st.markdown(response)
-                    except Exception as e:
-                        error_msg = f"An error occurred during AI processing: {e}. " \
-                                    "Please check the console for more details and ensure " \
-                                    f"Ollama server is running with the model '{config_data.get('ollama_model_name', 'mistral')}'. " \
-                                    "Also, ensure the FAISS index is built."
-                        st.error(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": "I apologize, an error occurred while processing your request. Please try again or check the server status."})
-                else:
-                    st.error("RAG Pipeline is not initialized. Please check the sidebar for instructions to set up the AI.")
-                    st.session_state.messages.append({"role": "assistant", "content": "The AI is not ready yet. Please try again after the system is fully initialized."})
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                except Exception as e:
+                    error_msg = f"An error occurred during AI processing: {e}. " \
+                                "Please check the console for more details and ensure " \
+                                f"Ollama server is running with the model '{config_data.get('ollama_model_name', 'mistral')}'. " \
+                                "Also, ensure the FAISS index is built."
+                    st.error(error_msg)
+                    st.session_state.messages.append({"role": "assistant", "content": "I apologize, an error occurred while processing your request. Please try again or check the server status."})
+            else:
+                st.error("RAG Pipeline is not initialized. Please check the sidebar for instructions to set up the AI.")
+                st.session_state.messages.append({"role": "assistant", "content": "The AI is not ready yet. Please try again after the system is fully initialized."})
 
     with tab2:
         st.header("Community FAQs")
@@ -214,10 +350,7 @@ def show_main_app():
         search_query = st.text_input("Search FAQs:", placeholder="e.g., 'case statement' or 'file handling'")
         
         if search_query:
-            filtered_faqs_df = faqs_df[
-                faqs_df['question'].str.contains(search_query, case=False, na=False) |
-                faqs_df['answer'].str.contains(search_query, case=False, na=False)
-            ]
+            filtered_faqs_df = faqs_df[faqs_df['_search'].str.contains(search_query.lower(), regex=False, na=False)]
         else:
             filtered_faqs_df = faqs_df
         
@@ -225,10 +358,17 @@ def show_main_app():
             for index, faq in filtered_faqs_df.iterrows():
                 with st.expander(f"❓ {faq['question']}"):
                     st.markdown(f"**Answer:** {faq['answer']}")
-                    st.markdown(f"<small>Created by: {faq.get('created_by', 'Anonymous')} on {faq['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}</small>", unsafe_allow_html=True)
+                    st.markdown(f"<small>Created by: {faq.get('created_by', 'Anonymous')} on {faq['_ts_str']}</small>", unsafe_allow_html=True)
         else:
             st.info("No FAQs match your search or have been contributed yet.")
 
+        if not faqs_df.empty and st.button("Export FAQs to Excel"):
+            try:
+                save_data_to_excel_fast(faqs_df, EXCEL_FAQ_FILE)
+                st.success(f"FAQs exported to {EXCEL_FAQ_FILE}.")
+            except Exception as e:
+                st.error(f"Error exporting to {EXCEL_FAQ_FILE}: {e}")
+
     with tab3:
         st.header("Ask & Answer Questions")
         st.info("Ask a question for a community member to answer, or answer a pending question below.")
@@ -239,15 +379,13 @@ def show_main_app():
             new_question = st.text_area("Your Question about Camos:", height=100)
             submitted_q = st.form_submit_button("Submit Question")
             if submitted_q and new_question:
-                pending_df = load_data_from_excel(PENDING_QUESTIONS_FILE, ['id', 'question', 'timestamp', 'asked_by'])
-                new_row = pd.DataFrame([{
+                new_row = {
                     'id': str(time.time_ns()),
                     'question': new_question.strip(),
-                    'timestamp': pd.to_datetime('now'),
+                    'timestamp': pd.Timestamp.now().isoformat(),
                     'asked_by': st.session_state.user_data['name']
-                }])
-                pending_df = pd.concat([new_row, pending_df], ignore_index=True)
-                if save_data_to_excel(pending_df, PENDING_QUESTIONS_FILE):
+                }
+                if append_row(PENDING_QUESTIONS_FILE, new_row):
                     st.success("Your question has been submitted for review and will appear below.")
                     st.rerun()
             elif submitted_q:
@@ -260,7 +398,7 @@ def show_main_app():
         if not pending_df.empty:
             for index, pending_q in pending_df.iterrows():
                 with st.expander(f"❓ {pending_q['question']}"):
-                    st.markdown(f"<small>Asked by: {pending_q.get('asked_by', 'Anonymous')} on {pending_q['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}</small>", unsafe_allow_html=True)
+                    st.markdown(f"<small>Asked by: {pending_q.get('asked_by', 'Anonymous')} on {pending_q['_ts_str']}</small>", unsafe_allow_html=True)
                     
                     if CAN_ANSWER_QUESTION:
                         with st.form(f"answer_form_{pending_q['id']}"):
@@ -272,20 +410,16 @@ def show_main_app():
                             
                             if submitted_a and answer:
                                 # Add the new Q&A to the main FAQ list
-                                faqs_df = load_data_from_excel(EXCEL_FAQ_FILE, ['id', 'question', 'answer', 'timestamp', 'created_by'])
-                                new_faq_row = pd.DataFrame([{
-                                    'id': pending_q['id'],
+                                append_row(EXCEL_FAQ_FILE, {
+                                    'id': str(pending_q['id']),
                                     'question': pending_q['question'],
                                     'answer': answer.strip(),
-                                    'timestamp': pd.to_datetime('now'),
+                                    'timestamp': pd.Timestamp.now().isoformat(),
                                     'created_by': st.session_state.user_data['name']
-                                }])
-                                faqs_df = pd.concat([new_faq_row, faqs_df], ignore_index=True)
-                                save_data_to_excel(faqs_df, EXCEL_FAQ_FILE)
+                                })
                                 
                                 # Remove the answered question from the pending list
-                                pending_df = pending_df.drop(index)
-                                save_data_to_excel(pending_df, PENDING_QUESTIONS_FILE)
+                                delete_record(PENDING_QUESTIONS_FILE, pending_q['id'])
                                 
                                 st.success("Answer submitted and added to FAQs!")
                                 st.rerun()
@@ -1,27 +1,49 @@
 # src/data_ingestor.py
 import os
+import itertools
+import multiprocessing
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import faiss
 import fitz # PyMuPDF
 from PIL import Image
-import pytesseract
+import tesserocr
 import io
 import camelot
 import pandas as pd
 from langchain_community.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import SentenceTransformerEmbeddings
+from transformers import AutoTokenizer
 from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
+from src.utils import get_embeddings, load_config
 
-# Set the path to the Tesseract executable if not in PATH
-# pytesseract.pytesseract.tesseract_cmd = r'/usr/local/bin/tesseract' # Example for macOS
-# pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe' # Example for Windows
+# tesserocr uses the tessdata directory from the TESSDATA_PREFIX environment variable if not found by default
+# os.environ['TESSDATA_PREFIX'] = r'/usr/share/tesseract-ocr/5/tessdata' # Example for Linux
+# os.environ['TESSDATA_PREFIX'] = r'C:\Program Files\Tesseract-OCR\tessdata' # Example for Windows
+
+# Images smaller than this (in pixels) or whose page area already has this much text are not OCR'd
+MIN_OCR_IMAGE_AREA = 64 * 64
+MIN_BBOX_TEXT_CHARS = 20
+# Image compression filters that extract_image returns as formats we don't OCR (jpx, jb2)
+NON_OCR_IMAGE_FILTERS = ("JPXDecode", "JBIG2Decode")
+# Pages with fewer drawn segments (lines, rects, curves) than this can't hold a ruled table, so Camelot skips them
+MIN_TABLE_DRAWING_ITEMS = 10
+
+@lru_cache(maxsize=None)
+def _get_tesseract_api():
+    """Returns the Tesseract API handle for this process, loading the language model only once."""
+    return tesserocr.PyTessBaseAPI(lang='eng')
 
 def extract_text_from_image_ocr(image_bytes):
     """Extracts text from an image using Tesseract OCR."""
     try:
         image = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(image)
-        return text
+        api = _get_tesseract_api()
+        api.SetImage(image)
+        return api.GetUTF8Text()
     except Exception as e:
         print(f"Error during OCR: {e}")
         return ""
@@ -32,31 +54,50 @@ def extract_additional_content_from_pdf(filepath):
     Returns a list of Document objects with extracted content.
     """
     additional_docs = []
+    filename_base = os.path.basename(filepath)
     try:
-        document = fitz.open(filepath)
-        filename_base = os.path.basename(filepath)
-
-        # 1. OCR from Images
-        for page_num in range(len(document)):
-            page = document.load_page(page_num)
-            image_list = page.get_images(full=True)
-
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = document.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-
-                if image_ext in ["png", "jpeg", "jpg"]:
-                    text_from_image = extract_text_from_image_ocr(image_bytes)
-                    if text_from_image.strip():
-                        additional_docs.append(Document(
-                            page_content=f"Image content from page {page_num + 1}:\n{text_from_image}",
-                            metadata={"source": filename_base, "page": page_num + 1, "type": "image_ocr", "image_index": img_index + 1}
-                        ))
-        
-        # 2. Table Extraction with Camelot
-        tables = camelot.read_pdf(filepath, pages='all', flavor='stream', line_scale=40)
+        with fitz.open(filepath) as document:
+            # 1. OCR from Images (also noting pages with enough vector drawings to hold a ruled table)
+            table_pages = []
+            for page_num in range(len(document)):
+                page = document.load_page(page_num)
+                # Count segments, not paths: a whole ruled grid may be drawn as a single path
+                if sum(len(drawing["items"]) for drawing in page.get_drawings()) >= MIN_TABLE_DRAWING_ITEMS:
+                    table_pages.append(page_num + 1)
+                image_list = page.get_images(full=True)
+
+                for img_index, img in enumerate(image_list):
+                    xref, width, height = img[0], img[2], img[3]
+                    if width * height < MIN_OCR_IMAGE_AREA:
+                        continue # Icons/bullets are too small for useful OCR
+                    _, image_filter = document.xref_get_key(xref, "Filter")
+                    if any(f in image_filter for f in NON_OCR_IMAGE_FILTERS):
+                        continue # Would decode to jpx/jb2, which isn't OCR'd; skip before decompressing
+                    try:
+                        bbox = page.get_image_bbox(img)
+                        if len(page.get_textbox(bbox).strip()) > MIN_BBOX_TEXT_CHARS:
+                            continue # The text layer already covers this image
+                    except ValueError:
+                        pass # Image isn't placed on this page; OCR it anyway
+
+                    base_image = document.extract_image(xref)
+                    image_bytes = base_image["image"]
+                    image_ext = base_image["ext"]
+                    del base_image
+
+                    if image_ext in ["png", "jpeg", "jpg"]:
+                        text_from_image = extract_text_from_image_ocr(image_bytes)
+                        if text_from_image.strip():
+                            additional_docs.append(Document(
+                                page_content=f"Image content from page {page_num + 1}:\n{text_from_image}",
+                                metadata={"source": filename_base, "page": page_num + 1, "type": "image_ocr", "image_index": img_index + 1}
+                            ))
+                    del image_bytes # Drop the decoded image before the next one is extracted
+
+        # 2. Table Extraction with Camelot, only on pages with ruling lines
+        tables = []
+        if table_pages:
+            tables = camelot.read_pdf(filepath, pages=','.join(map(str, table_pages)), flavor='lattice', line_scale=40)
         for i, table in enumerate(tables):
             df = table.df
             table_markdown = f"Table {i+1} from page {table.page}:\n\n"
@@ -71,60 +112,131 @@ def extract_additional_content_from_pdf(filepath):
         print(f"Error extracting additional content from {filename_base}: {e}")
     return additional_docs
 
-def load_and_process_camos_docs(pdf_dir, chunk_size, chunk_overlap):
+@lru_cache(maxsize=None)
+def _get_text_splitter(tokenizer_name, chunk_size, chunk_overlap):
+    """
+    Returns a splitter that measures chunks in tokens of the embedding model's tokenizer,
+    built once per process and reused across PDFs. `chunk_size` is the model's full input
+    length, so room is left for the special tokens ([CLS]/[SEP]) the model adds.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=chunk_size - tokenizer.num_special_tokens_to_add(),
+        chunk_overlap=chunk_overlap
+    )
+
+def _process_one_pdf(pdf_file_path, chunk_size, chunk_overlap, tokenizer_name):
+    """
+    Loads one PDF (text, OCR, tables) and returns its chunked Document objects.
+    Runs in a worker process, so the text splitter is built here rather than pickled.
+    """
+    try:
+        text_splitter = _get_text_splitter(tokenizer_name, chunk_size, chunk_overlap)
+
+        # Load main text content using PyMuPDFLoader
+        loader = PyMuPDFLoader(pdf_file_path)
+        docs = loader.load()
+
+        # Extract additional content (OCR from images, tables)
+        additional_docs = extract_additional_content_from_pdf(pdf_file_path)
+
+        # Combine and chunk all documents
+        combined_docs = docs + additional_docs
+        chunked_docs = text_splitter.split_documents(combined_docs)
+        print(f"Processed and chunked {os.path.basename(pdf_file_path)} into {len(chunked_docs)} chunks.")
+        return chunked_docs
+    except Exception as e:
+        print(f"Error processing PDF {os.path.basename(pdf_file_path)}: {e}")
+        return []
+
+def load_and_process_camos_docs(pdf_dir, chunk_size, chunk_overlap, tokenizer_name):
     """
     Loads PDFs, extracts content (text, OCR, tables), chunks them,
     and returns a list of LangChain Document objects.
+    PDFs are processed in parallel, one worker process per CPU core.
+    chunk_size and chunk_overlap are counted in tokens of `tokenizer_name`
+    (normally the embedding model, so chunks fit its input window).
     """
-    all_documents = []
-    text_splitter = RecursiveCharacterTextSplitter(
+    pdf_files = [os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.endswith(".pdf")]
+    if not pdf_files:
+        return []
+
+    process_pdf = partial(
+        _process_one_pdf,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len
+        tokenizer_name=tokenizer_name
     )
+    # Spawn rather than fork: ingestion is started from the multi-threaded Streamlit server with torch loaded
+    with ProcessPoolExecutor(
+        max_workers=min(len(pdf_files), os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = list(executor.map(process_pdf, pdf_files))
 
-    pdf_files = [os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.endswith(".pdf")]
+    return list(itertools.chain.from_iterable(results))
 
-    for pdf_file_path in pdf_files:
-        try:
-            # Load main text content using PyMuPDFLoader
-            loader = PyMuPDFLoader(pdf_file_path)
-            docs = loader.load()
-            
-            # Extract additional content (OCR from images, tables)
-            additional_docs = extract_additional_content_from_pdf(pdf_file_path)
-            
-            # Combine and chunk all documents
-            combined_docs = docs + additional_docs
-            chunked_docs = text_splitter.split_documents(combined_docs)
-            all_documents.extend(chunked_docs)
-            print(f"Processed and chunked {os.path.basename(pdf_file_path)} into {len(chunked_docs)} chunks.")
-        except Exception as e:
-            print(f"Error processing PDF {os.path.basename(pdf_file_path)}: {e}")
-            
-    return all_documents
-
-def create_and_save_vector_store(documents, embedding_model_name, embedding_model_kwargs, vector_store_path):
+def _rebuild_faiss_index(vectorstore, index_factory):
+    """
+    Replaces the flat index of a FAISS vector store with one built from a
+    faiss.index_factory description (e.g. "HNSW32,Flat"), keeping vector order
+    so the docstore id mapping stays valid.
+    """
+    flat_index = vectorstore.index
+    vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+    index = faiss.index_factory(flat_index.d, index_factory, flat_index.metric_type)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    vectorstore.index = index
+
+def create_and_save_vector_store(documents, embedding_model_name, embedding_model_kwargs, vector_store_path, index_factory=None, embedding_backend="sentence_transformers"):
     """
     Creates embeddings for documents and saves them to a FAISS vector store.
+    If `index_factory` is given, the default flat (exhaustive) index is rebuilt
+    with it so queries no longer scan every vector.
     """
     if not documents:
         print("No documents to add to vector store.")
         return None
 
     print(f"Creating embeddings with model: {embedding_model_name}")
-    embeddings = SentenceTransformerEmbeddings(
-        model_name=embedding_model_name,
-        model_kwargs=embedding_model_kwargs
-    )
+    embeddings = get_embeddings(embedding_model_name, embedding_model_kwargs, embedding_backend)
     
     print(f"Creating and saving FAISS vector store to {vector_store_path}")
     vectorstore = FAISS.from_documents(documents, embeddings)
+    if index_factory:
+        print(f"Building '{index_factory}' FAISS index")
+        _rebuild_faiss_index(vectorstore, index_factory)
     vectorstore.save_local(vector_store_path)
     print("Vector store created and saved successfully.")
     return vectorstore
 
-def load_vector_store(embedding_model_name, embedding_model_kwargs, vector_store_path):
+def _load_faiss_local_mmap(vector_store_path, embeddings):
+    """
+    Loads a vector store saved with FAISS.save_local. On faiss >= 1.10 the index is read with
+    IO_FLAG_MMAP_IFC, which memory-maps flat vector storage (flat indexes and the storage of
+    "HNSW32,Flat") zero-copy, so the OS pages vectors in on demand. Older faiss builds, and
+    index types without flat storage (e.g. IVF-PQ), are read fully into RAM.
+    """
+    index_path = os.path.join(vector_store_path, "index.faiss")
+    index = None
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC)
+        except RuntimeError as e:
+            print(f"Index can't be memory-mapped ({e}); loading it into RAM.")
+    else:
+        print("This faiss version (< 1.10) can't memory-map the index; loading it into RAM.")
+    if index is None:
+        index = faiss.read_index(index_path)
+    # The docstore pickle is written by our own save_local, same trust model as allow_dangerous_deserialization
+    with open(os.path.join(vector_store_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def load_vector_store(embedding_model_name, embedding_model_kwargs, vector_store_path, embedding_backend="sentence_transformers"):
     """
     Loads an existing FAISS vector store.
     """
@@ -133,12 +245,47 @@ def load_vector_store(embedding_model_name, embedding_model_kwargs, vector_store
         return None
 
     print(f"Loading embeddings with model: {embedding_model_name}")
-    embeddings = SentenceTransformerEmbeddings(
-        model_name=embedding_model_name,
-        model_kwargs=embedding_model_kwargs
-    )
+    embeddings = get_embeddings(embedding_model_name, embedding_model_kwargs, embedding_backend)
     
     print(f"Loading FAISS vector store from {vector_store_path}")
-    vectorstore = FAISS.load_local(vector_store_path, embeddings, allow_dangerous_deserialization=True) # allow_dangerous_deserialization is needed for newer FAISS versions
+    vectorstore = _load_faiss_local_mmap(vector_store_path, embeddings)
     print("Vector store loaded successfully.")
-    return vectorstore
\ No newline at end of file
+    return vectorstore
+
+# Exit codes of `python -m src.data_ingestor`
+INGEST_OK = 0
+INGEST_FAILED = 1
+INGEST_NO_DOCUMENTS = 2
+
+def ingest_from_config(config):
+    """
+    Processes the configured PDFs and builds and saves the FAISS index.
+    Returns one of the INGEST_* exit codes.
+    """
+    vector_store_path = config.get('vector_store_path', "data/faiss_index")
+    embedding_model_name = config.get('embedding_model_name', "sentence-transformers/all-MiniLM-L6-v2")
+    os.makedirs(vector_store_path, exist_ok=True)
+    all_documents = load_and_process_camos_docs(
+        config.get('pdf_data_dir', "data/raw_pdfs"),
+        config.get('chunk_size', 256),
+        config.get('chunk_overlap', 32),
+        embedding_model_name
+    )
+    if not all_documents:
+        print("No documents were loaded or processed for ingestion.")
+        return INGEST_NO_DOCUMENTS
+
+    vectorstore = create_and_save_vector_store(
+        all_documents,
+        embedding_model_name,
+        config.get('embedding_model_kwargs', {'device': 'auto'}),
+        vector_store_path,
+        config.get('faiss_index_factory'),
+        config.get('embedding_backend', "sentence_transformers")
+    )
+    return INGEST_OK if vectorstore else INGEST_FAILED
+
+if __name__ == "__main__":
+    # The app runs ingestion as `python -m src.data_ingestor <config>`: spawned PDF workers re-import
+    # the main module, and this keeps them from re-running the Streamlit script (and its RAG pipeline).
+    sys.exit(ingest_from_config(load_config(sys.argv[1] if len(sys.argv) > 1 else "config/model_config.yaml")))
@@ -0,0 +1,65 @@
+# src/embeddings_backend.py
+import os
+import numpy as np
+import onnxruntime
+from langchain_core.embeddings import Embeddings
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+class ONNXInt8Embeddings(Embeddings):
+    """
+    Sentence embeddings from an int8 dynamically quantized ONNX export of a
+    sentence-transformers model, run on CPU with ONNX Runtime. Uses mean pooling
+    and L2 normalization, matching all-MiniLM-L6-v2.
+    """
+    def __init__(self, model_name, cache_dir="data/onnx_models", batch_size=64, max_seq_length=256):
+        model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        if not os.path.exists(os.path.join(model_dir, QUANTIZED_MODEL_FILE)):
+            print(f"Exporting {model_name} to int8 ONNX in {model_dir}")
+            self._export_quantized(model_name, model_dir)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir,
+            file_name=QUANTIZED_MODEL_FILE,
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+
+    @staticmethod
+    def _export_quantized(model_name, model_dir):
+        """Exports the model to ONNX and saves a dynamically quantized (VNNI int8) copy plus its tokenizer."""
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        quantizer = ORTQuantizer.from_pretrained(model)
+        quantizer.quantize(
+            save_dir=model_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        )
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+    def embed_documents(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            token_embeddings = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.linalg.norm(pooled, axis=1, keepdims=True)
+            embeddings.extend(pooled.tolist())
+        return embeddings
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -1,11 +1,119 @@
 # src/rag_pipeline.py
 import os
-from langchain_community.embeddings import SentenceTransformerEmbeddings
+import asyncio
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain_community.llms import Ollama
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from src.utils import load_prompt_templates
+from langchain.memory import ConversationSummaryBufferMemory
+from transformers import AutoTokenizer
+from src.utils import load_prompt_templates, get_embeddings
+
+class _QueryCache:
+    """
+    Two-tier cache of RAG answers: an exact match on the normalized question, then the
+    most similar earlier question by cosine similarity. The oldest entry is evicted first.
+    """
+    def __init__(self, max_size=1024, similarity_threshold=0.97):
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict() # normalized question -> (vector id, answer)
+        self._keys_by_id = {}
+        self._index = None # Created on first insert, once the embedding dimension is known
+        self._next_id = 0
+        self._lock = threading.Lock() # The pipeline is shared by all Streamlit sessions
+
+    @staticmethod
+    def normalize(question):
+        return " ".join(question.lower().split())
+
+    def get_exact(self, question):
+        with self._lock:
+            entry = self._entries.get(self.normalize(question))
+            return entry[1] if entry else None
+
+    def get_similar(self, query_vector):
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(query_vector, 1)
+            if ids[0][0] != -1 and scores[0][0] >= self.similarity_threshold:
+                return self._entries[self._keys_by_id[int(ids[0][0])]][1]
+            return None
+
+    def put(self, question, query_vector, answer):
+        key = self.normalize(question)
+        with self._lock:
+            if key in self._entries:
+                return
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(query_vector.shape[1]))
+            vector_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(query_vector, np.array([vector_id], dtype=np.int64))
+            self._entries[key] = (vector_id, answer)
+            self._keys_by_id[vector_id] = key
+
+            if len(self._entries) > self.max_size:
+                _, (oldest_id, _) = self._entries.popitem(last=False)
+                del self._keys_by_id[oldest_id]
+                self._index.remove_ids(np.array([oldest_id], dtype=np.int64))
+
+class ConversationMemory:
+    """
+    Chat memory for one session that keeps the prompt size roughly constant: a summary buffer
+    (running summary plus the latest turns, capped at `max_token_limit`) and a small FAISS index
+    of all turns. Only turns already pruned from the buffer are searched, and the few most
+    relevant to the current question are added, each cut to `max_turn_chars`.
+    """
+    def __init__(self, llm, max_token_limit=512, relevant_turns=3, max_turn_chars=500):
+        self.summary_memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=max_token_limit)
+        self.relevant_turns = relevant_turns
+        self.max_turn_chars = max_turn_chars
+        self._turns = []
+        self._index = None # Created on the first turn, once the embedding dimension is known
+
+    def is_empty(self):
+        return not self._turns
+
+    def _pruned_turn_count(self):
+        """Number of leading turns no longer (fully) in the verbatim buffer; each turn is two messages."""
+        buffered_turns = (len(self.summary_memory.chat_memory.messages) + 1) // 2
+        return len(self._turns) - buffered_turns
+
+    def _relevant_pruned_turns(self, query_vector):
+        pruned = self._pruned_turn_count()
+        if self._index is None or pruned <= 0:
+            return []
+        _, ids = self._index.search(query_vector, len(self._turns))
+        top_ids = [i for i in ids[0] if 0 <= i < pruned][:self.relevant_turns]
+        return [self._turns[i] for i in sorted(top_ids)]
+
+    def chat_history(self, query_vector):
+        """Returns the history text for the prompt, given the normalized embedding of the current question."""
+        parts = []
+        summary = self.summary_memory.load_memory_variables({})['history']
+        if summary:
+            parts.append(summary)
+        relevant = [
+            turn if len(turn) <= self.max_turn_chars else turn[:self.max_turn_chars].rstrip() + "..."
+            for turn in self._relevant_pruned_turns(query_vector)
+        ]
+        if relevant:
+            parts.append("Earlier turns related to this question:\n" + "\n\n".join(relevant))
+        return "\n\n".join(parts)
+
+    def add_turn(self, question, answer, query_vector):
+        # Record the turn first so the turn list and index stay in step even if summarizing fails
+        if self._index is None:
+            self._index = faiss.IndexFlatIP(query_vector.shape[1])
+        self._index.add(query_vector)
+        self._turns.append(f"Human: {question}\nAI: {answer}")
+        self.summary_memory.save_context({"input": question}, {"output": answer})
 
 class CamosRAGPipeline:
     """
@@ -16,17 +124,22 @@ class CamosRAGPipeline:
         self.prompt_templates = load_prompt_templates("config/prompt_templates.yaml")
 
         # Initialize Embedding Model
-        self.embeddings = SentenceTransformerEmbeddings(
-            model_name=self.config['embedding_model_name'],
-            model_kwargs=self.config['embedding_model_kwargs']
+        self.embeddings = get_embeddings(
+            self.config['embedding_model_name'],
+            self.config['embedding_model_kwargs'],
+            self.config.get('embedding_backend', "sentence_transformers")
         )
         print(f"Embeddings initialized with model: {self.config['embedding_model_name']}")
 
-        # Initialize Ollama LLM
+        # Initialize Ollama LLM. Tokens (for the chat memory's summary limit) are counted with the
+        # embedding model's tokenizer, which is available locally, instead of LangChain's default
+        # GPT-2 tokenizer that would be downloaded from the Hugging Face Hub.
+        token_counter = AutoTokenizer.from_pretrained(self.config['embedding_model_name'])
         self.llm = Ollama(
             base_url=self.config['ollama_base_url'],
             model=self.config['ollama_model_name'],
-            temperature=self.config['ollama_temperature']
+            temperature=self.config['ollama_temperature'],
+            custom_get_token_ids=lambda text: token_counter.encode(text, add_special_tokens=False)
         )
         print(f"Ollama LLM initialized with model: {self.config['ollama_model_name']}")
 
@@ -40,7 +153,13 @@ class CamosRAGPipeline:
             print("WARNING: Vector store not loaded, RAG chain will not be fully functional.")
 
         # Initialize RAG Chain
+        self.rag_prompt = PromptTemplate.from_template(self.prompt_templates['rag_template'])
+        self.conversational_rag_prompt = PromptTemplate.from_template(self.prompt_templates['conversational_rag_template'])
         self.qa_chain = self._initialize_qa_chain()
+        self._query_cache = _QueryCache(
+            max_size=self.config.get('query_cache_size', 1024),
+            similarity_threshold=self.config.get('query_cache_similarity_threshold', 0.97)
+        )
         print("RAG Pipeline initialized.")
 
     def _load_or_recreate_vector_store(self):
@@ -51,7 +170,8 @@ class CamosRAGPipeline:
             return load_vector_store(
                 self.config['embedding_model_name'],
                 self.config['embedding_model_kwargs'],
-                vector_store_path
+                vector_store_path,
+                self.config.get('embedding_backend', "sentence_transformers")
             )
         else:
             print(f"FAISS index not found at {vector_store_path}. Please ingest data first.")
@@ -62,30 +182,152 @@ class CamosRAGPipeline:
         if not self.retriever:
             return None
         
-        # Create prompt template for RAG
-        rag_prompt = PromptTemplate.from_template(self.prompt_templates['rag_template'])
-
         qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff", # 'stuff' combines all docs into one prompt
             retriever=self.retriever,
             return_source_documents=True, # To show which documents were used
-            chain_type_kwargs={"prompt": rag_prompt}
+            chain_type_kwargs={"prompt": self.rag_prompt}
         )
         return qa_chain
 
+    @staticmethod
+    def _to_query_vector(embedding):
+        """Converts an embedding to a normalized (1, d) float32 array, so inner product is cosine similarity."""
+        query_vector = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(query_vector)
+        return query_vector
+
+    def _embed_query(self, question):
+        return self._to_query_vector(self.embeddings.embed_query(question))
+
+    def _lookup_cache(self, question):
+        """Returns (cached answer or None, query vector or None); the vector is only computed on an exact-match miss."""
+        cached_answer = self._query_cache.get_exact(question)
+        if cached_answer is not None:
+            return cached_answer, None
+        query_vector = self._embed_query(question)
+        return self._query_cache.get_similar(query_vector), query_vector
+
     def query_rag(self, question):
-        """Queries the RAG pipeline."""
+        """Queries the RAG pipeline, answering repeated or near-identical questions from the cache."""
         if not self.qa_chain:
             return "RAG system not ready. Please ensure data has been ingested."
-        
+
         try:
+            cached_answer, query_vector = self._lookup_cache(question)
+            if cached_answer is not None:
+                return cached_answer
+
             result = self.qa_chain({"query": question})
+            self._query_cache.put(question, query_vector, result['result'])
             return result['result']
         except Exception as e:
             print(f"Error during RAG query: {e}")
             return f"An error occurred during AI processing: {e}. Please ensure Ollama server is running and the model '{self.config['ollama_model_name']}' is pulled."
 
+    def create_memory(self):
+        """Creates an empty conversation memory for one chat session."""
+        return ConversationMemory(self.llm, max_token_limit=self.config.get('memory_max_token_limit', 512))
+
+    def _build_prompt(self, question, docs, memory, query_vector):
+        """Fills the 'stuff' RAG prompt, adding bounded chat history when the conversation has any."""
+        context = "\n\n".join(doc.page_content for doc in docs)
+        if memory is None or memory.is_empty():
+            return self.rag_prompt.format(context=context, question=question)
+        return self.conversational_rag_prompt.format(
+            chat_history=memory.chat_history(query_vector),
+            context=context,
+            question=question
+        )
+
+    async def _awarm_up_llm(self, prompt_prefix):
+        """
+        Has Ollama load the model and evaluate the fixed start of the prompt (one token generated),
+        so the real request can reuse it. Failures are ignored; the real request reports them.
+        """
+        try:
+            await self.llm.agenerate([prompt_prefix], num_predict=1)
+        except Exception as e:
+            print(f"Ollama warm-up failed: {e}")
+
+    async def _aprepare(self, question, memory):
+        """
+        Returns (cached answer, query vector, prompt) for a question; prompt is None on a cache hit.
+        The Ollama warm-up runs in the background while the question is embedded and documents are
+        retrieved; it is only awaited before building the prompt, and cancelled on a cache hit.
+        """
+        # Answers to follow-up questions depend on the conversation, so only first questions use the cache
+        use_cache = memory is None or memory.is_empty()
+        if use_cache:
+            cached_answer = self._query_cache.get_exact(question)
+            if cached_answer is not None:
+                return cached_answer, None, None
+
+        template = self.prompt_templates['rag_template' if use_cache else 'conversational_rag_template']
+        warm_up = asyncio.create_task(self._awarm_up_llm(template.split('{', 1)[0]))
+        try:
+            query_vector = self._to_query_vector(await self.embeddings.aembed_query(question))
+            if use_cache:
+                cached_answer = self._query_cache.get_similar(query_vector)
+                if cached_answer is not None:
+                    warm_up.cancel()
+                    return cached_answer, query_vector, None
+
+            # Same retrieval as qa_chain, reusing the query vector already computed for the cache
+            docs = self.vectorstore.similarity_search_by_vector(query_vector[0].tolist(), **self.retriever.search_kwargs)
+        except BaseException:
+            warm_up.cancel()
+            raise
+        await warm_up
+        return None, query_vector, self._build_prompt(question, docs, memory, query_vector)
+
+    def _finish_turn(self, question, answer, query_vector, memory, generated):
+        """Caches a newly generated first-question answer and records the turn in the conversation memory."""
+        if generated and (memory is None or memory.is_empty()):
+            self._query_cache.put(question, query_vector, answer)
+        if memory is not None:
+            memory.add_turn(question, answer, self._embed_query(question) if query_vector is None else query_vector)
+
+    def prepare_rag(self, question, memory=None):
+        """
+        Does the slow part of a RAG query up front (retrieval, cache lookup, prompt building) and
+        returns an iterator that yields the answer in chunks as Ollama generates it.
+        With a `memory` from create_memory, earlier turns inform the answer and the turn is recorded.
+        """
+        if not self.qa_chain:
+            return iter(["RAG system not ready. Please ensure data has been ingested."])
+
+        try:
+            cached_answer, query_vector, prompt = asyncio.run(self._aprepare(question, memory))
+        except Exception as e:
+            print(f"Error during RAG query: {e}")
+            return iter([f"An error occurred during AI processing: {e}. Please ensure Ollama server is running and the model '{self.config['ollama_model_name']}' is pulled."])
+        return self._stream_answer(question, memory, cached_answer, query_vector, prompt)
+
+    def _stream_answer(self, question, memory, cached_answer, query_vector, prompt):
+        generated = cached_answer is None
+        try:
+            if generated:
+                chunks = []
+                for chunk in self.llm.stream(prompt):
+                    chunks.append(chunk)
+                    yield chunk
+                answer = "".join(chunks)
+            else:
+                answer = cached_answer
+                yield answer
+        except Exception as e:
+            print(f"Error during RAG query: {e}")
+            yield f"An error occurred during AI processing: {e}. Please ensure Ollama server is running and the model '{self.config['ollama_model_name']}' is pulled."
+            return
+
+        # Bookkeeping (which may summarize older turns with the LLM) must not add an error to a finished answer
+        try:
+            self._finish_turn(question, answer, query_vector, memory, generated)
+        except Exception as e:
+            print(f"Error recording chat turn: {e}")
+
     def debug_code(self, code_snippet, error_message):
         """Uses Ollama directly to debug a code snippet."""
         # This bypasses RAG for a direct LLM call focused on debugging
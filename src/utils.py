@@ -1,23 +1,72 @@
 # src/utils.py
+import functools
 import yaml
 import time
 import requests # Keeping for Ollama client, though LangChain wrappers are used for core LLM
 import json
 import os
+import streamlit as st
+import torch
+from langchain_community.embeddings import SentenceTransformerEmbeddings
+
+@st.cache_resource(show_spinner=False)
+def _load_yaml_cached(filepath, mtime):
+    """Parses a YAML file. `mtime` is only part of the cache key, so editing the file invalidates it."""
+    with open(filepath, 'r') as f:
+        return yaml.safe_load(f)
 
 def load_config(filepath):
     """Loads a YAML configuration file."""
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Config file not found: {filepath}")
-    with open(filepath, 'r') as f:
-        return yaml.safe_load(f)
+    return _load_yaml_cached(filepath, os.stat(filepath).st_mtime_ns)
 
 def load_prompt_templates(filepath):
     """Loads prompt templates from a YAML file."""
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Prompt templates file not found: {filepath}")
-    with open(filepath, 'r') as f:
-        return yaml.safe_load(f)
+    return _load_yaml_cached(filepath, os.stat(filepath).st_mtime_ns)
+
+def create_embeddings(model_name, model_kwargs, backend="sentence_transformers"):
+    """
+    Creates SentenceTransformer embeddings on CUDA in fp16 with large batches when a GPU is
+    available (device 'auto' or 'cuda'), otherwise on CPU in fp32 with smaller batches.
+    backend="onnx_int8" instead uses an int8 quantized ONNX export on CPU (model_kwargs are ignored).
+    """
+    if backend == "onnx_int8":
+        from src.embeddings_backend import ONNXInt8Embeddings # Import locally; optimum is only needed for this backend
+        print("Embeddings running on cpu (ONNX Runtime, int8)")
+        return ONNXInt8Embeddings(model_name)
+
+    model_kwargs = dict(model_kwargs or {})
+    device = model_kwargs.get('device', 'auto')
+    if device == 'auto' or (device.startswith('cuda') and not torch.cuda.is_available()):
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model_kwargs['device'] = device
+    on_gpu = device.startswith('cuda')
+
+    embeddings = SentenceTransformerEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'batch_size': 256 if on_gpu else 64, 'normalize_embeddings': True, 'convert_to_numpy': True}
+    )
+    if on_gpu:
+        embeddings.client.half()
+    # Warm up once so kernel selection/allocation doesn't land on the first user-visible query
+    embeddings.embed_documents(["warmup"])
+    print(f"Embeddings running on {device}{' (fp16)' if on_gpu else ''}")
+    return embeddings
+
+@functools.lru_cache(maxsize=4)
+def _get_embeddings_cached(model_name, kwargs_frozen, backend):
+    return create_embeddings(model_name, dict(kwargs_frozen), backend)
+
+def get_embeddings(model_name, model_kwargs, backend="sentence_transformers"):
+    """
+    Returns a shared embeddings instance for (model_name, model_kwargs, backend), so the RAG
+    pipeline and the ingestor don't each load their own copy of the model.
+    """
+    return _get_embeddings_cached(model_name, frozenset((model_kwargs or {}).items()), backend)
 
 # The exponential_backoff_request is less critical now as LangChain's Ollama integration
 # handles retries and connection, but can be kept if direct requests are still needed.